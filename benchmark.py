@@ -0,0 +1,396 @@
+"""Benchmark suite for PixelMed report generation and image handling.
+
+Measures wall time, peak RSS and output size for Markdown parsing,
+``create_pdf_report`` and the image I/O done on the analyze path, using
+synthetic reports and images. Model calls go through an offline replay
+transport, so only local work is timed.
+
+Each case runs in its own interpreter, so memory figures are independent of
+case order and ``--filter``.
+
+Usage:
+    python benchmark.py run --output results.json
+    python benchmark.py run --quick --baseline baselines/benchmark.json
+    python benchmark.py compare baselines/benchmark.json results.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from io import BytesIO
+
+from PIL import Image
+
+import main
+from routing import build_router, load_policy
+from transport import ReplayTransport
+
+
+REPORT_SIZES = {"small": 20, "typical": 120, "10k": 10000}
+IMAGE_SIZES = [256, 1024, 4096, 8192]
+QUICK_IMAGE_SIZES = [256, 1024]
+BATCH_SIZES = [1, 10, 50]
+QUICK_BATCH_SIZES = [1, 10]
+
+# Extensions accepted by the uploader in main.py, mapped to PIL formats.
+IMAGE_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "bmp": "BMP", "gif": "GIF"}
+
+METRICS = ("wall_time_s", "peak_rss_mb", "output_size")
+
+
+# ------------------------------------
+# SYNTHETIC INPUTS
+# ------------------------------------
+def make_report(line_count):
+    """Return a Markdown report shaped like model output with ``line_count`` lines."""
+    section = [
+        "### 1. Image Type & Region",
+        "- Modality: chest X-ray, posteroanterior projection",
+        "- Image quality is adequate with no significant rotation",
+        "",
+        "### 2. Key Findings",
+        "1. Mild blunting of the left costophrenic angle",
+        "2. Cardiac silhouette within normal limits",
+        "The lung fields are otherwise clear without focal consolidation.",
+        "",
+        "### 3. Diagnostic Assessment",
+        "- Primary diagnosis: small left pleural effusion (confidence 70%)",
+        "- Differential: atelectasis, early consolidation",
+        "",
+    ]
+    lines = []
+    while len(lines) < line_count:
+        lines.extend(section)
+    return "\n".join(lines[:line_count])
+
+
+def make_image_bytes(size, image_format):
+    """Encode a synthetic grayscale scan of ``size`` x ``size`` pixels."""
+    noise = Image.effect_noise((size, size), 40)
+    gradient = Image.linear_gradient("L").resize((size, size))
+    image = Image.blend(noise, gradient, 0.6)
+
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+# ------------------------------------
+# MEASUREMENT
+# ------------------------------------
+def current_rss_bytes():
+    """Return the current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is kilobytes on Linux and bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RSSSampler:
+    """Samples RSS in a background thread and keeps the peak value."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+def measure(func, repeat):
+    """Run ``func`` ``repeat`` times and summarise wall time, peak RSS and output size.
+
+    ``rss_increase_mb`` is the peak RSS above the RSS measured before the
+    first run, i.e. the memory the case itself needed.
+    """
+    times = []
+    start_rss = current_rss_bytes()
+    peak = start_rss
+    output_size = 0
+    for _ in range(repeat):
+        with RSSSampler() as sampler:
+            start = time.perf_counter()
+            output_size = func()
+            times.append(time.perf_counter() - start)
+        peak = max(peak, sampler.peak)
+
+    return {
+        "wall_time_s": round(statistics.median(times), 6),
+        "wall_time_min_s": round(min(times), 6),
+        "peak_rss_mb": round(peak / (1024 * 1024), 2),
+        "rss_increase_mb": round((peak - start_rss) / (1024 * 1024), 2),
+        "output_size": output_size,
+        "repeat": repeat,
+    }
+
+
+# ------------------------------------
+# BENCHMARK CASES
+# ------------------------------------
+def analyze_upload(image_bytes, ext, work_dir):
+    """Mirror the app's analyze path: save the upload, analyze it, build the PDF."""
+    image_path = os.path.join(work_dir, f"temp_image.{ext}")
+    with open(image_path, "wb") as f:
+        f.write(image_bytes)
+
+    report, model_name = main.analyze_medical_image(image_path)
+    pdf_buffer = main.create_pdf_report(report, image_path, f"upload.{ext}", model_name)
+
+    os.remove(image_path)
+    return len(pdf_buffer.getvalue())
+
+
+def case_names(quick=False, pattern=None):
+    """Return the names of the cases a run would execute, in order."""
+    image_sizes = QUICK_IMAGE_SIZES if quick else IMAGE_SIZES
+    batch_sizes = QUICK_BATCH_SIZES if quick else BATCH_SIZES
+
+    names = []
+    for name in REPORT_SIZES:
+        names.append(f"markdown_parse/{name}")
+        names.append(f"pdf_report/{name}")
+    for size in image_sizes:
+        for ext in IMAGE_FORMATS:
+            names.append(f"analyze_image/{ext}/{size}px")
+    for batch_size in batch_sizes:
+        names.append(f"batch/{batch_size}")
+
+    return [name for name in names if not pattern or pattern in name]
+
+
+def iter_cases(names, work_dir):
+    """Yield (name, callable) for the cases in ``names``, building inputs lazily.
+
+    Each callable returns its output size: bytes for PDFs, number of
+    flowables for Markdown parsing.
+    """
+    def wanted(name):
+        return name in names
+
+    pdf_styles = main.get_pdf_styles()
+    reports = {name: make_report(count) for name, count in REPORT_SIZES.items()}
+    sample_image = os.path.join(work_dir, "sample.png")
+    with open(sample_image, "wb") as f:
+        f.write(make_image_bytes(1024, "PNG"))
+
+    for name, text in reports.items():
+        if wanted(f"markdown_parse/{name}"):
+            yield (
+                f"markdown_parse/{name}",
+                lambda text=text: len(main.parse_report_markdown(text, pdf_styles))
+            )
+        if wanted(f"pdf_report/{name}"):
+            yield (
+                f"pdf_report/{name}",
+                lambda text=text: len(main.create_pdf_report(text, sample_image, "sample.png").getvalue())
+            )
+
+    for size in IMAGE_SIZES:
+        for ext, image_format in IMAGE_FORMATS.items():
+            name = f"analyze_image/{ext}/{size}px"
+            if wanted(name):
+                image_bytes = make_image_bytes(size, image_format)
+                yield name, lambda b=image_bytes, e=ext: analyze_upload(b, e, work_dir)
+                del image_bytes
+
+    batch_image = make_image_bytes(1024, "JPEG")
+    for batch_size in BATCH_SIZES:
+        if wanted(f"batch/{batch_size}"):
+            yield (
+                f"batch/{batch_size}",
+                lambda n=batch_size: sum(
+                    analyze_upload(batch_image, "jpeg", work_dir) for _ in range(n)
+                )
+            )
+
+
+def run_case(name, repeat):
+    """Measure a single case in this process and return its result."""
+    # Keep the model out of the measurement.
+    replay = ReplayTransport(default_text=make_report(REPORT_SIZES["typical"]))
+    router = build_router(load_policy(), lambda model_name: replay)
+    main.get_router = lambda: router
+
+    with tempfile.TemporaryDirectory(prefix="pixelmed-bench-") as work_dir:
+        for _, func in iter_cases({name}, work_dir):
+            return measure(func, repeat)
+    raise ValueError(f"Unknown benchmark case: {name}")
+
+
+def run_benchmarks(quick=False, repeat=3, pattern=None):
+    """Run every benchmark case and return the results document.
+
+    Each case runs in a fresh interpreter so its RSS figures don't depend
+    on which cases ran before it.
+    """
+    results = {}
+    for name in case_names(quick, pattern):
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "case", name,
+                 "--repeat", str(repeat), "--result", result_path],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+            if completed.returncode != 0:
+                print(f"{name:<32} FAILED\n{completed.stderr.strip()}")
+                continue
+            result = load_json(result_path)
+        finally:
+            os.remove(result_path)
+
+        results[name] = result
+        print(f"{name:<32} {result['wall_time_s']:>10.4f}s "
+              f"{result['peak_rss_mb']:>9.1f} MB (+{result['rss_increase_mb']:.1f}) "
+              f"{result['output_size']:>12}")
+
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick,
+            "filter": pattern,
+        },
+        "results": results,
+    }
+
+
+# ------------------------------------
+# BASELINE COMPARISON
+# ------------------------------------
+def compare_results(baseline, current, threshold):
+    """Compare two result documents.
+
+    Returns ``(regressions, missing)``: metrics that grew by more than
+    ``threshold``, and cases the current run should have produced but that
+    are absent from it. Only cases inside the current run's scope (its
+    ``--quick`` and ``--filter`` settings) are expected, so a quick run can
+    be compared against a full baseline.
+    """
+    meta = current.get("meta", {})
+    expected = set(case_names(meta.get("quick", False), meta.get("filter")))
+    missing = sorted(
+        name for name in baseline["results"]
+        if name in expected and name not in current["results"]
+    )
+
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for metric in METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append({
+                    "case": name,
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(change, 4),
+                })
+    return regressions, missing
+
+
+def print_comparison(regressions, missing, threshold):
+    for name in missing:
+        print(f"  MISSING {name} (in baseline, not in current run)")
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%}.")
+        return
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%}:")
+    for r in regressions:
+        print(f"  {r['case']:<32} {r['metric']:<14} {r['baseline']} -> {r['current']} (+{r['change']:.1%})")
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(data, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="PixelMed benchmark suite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="Run the benchmarks")
+    run.add_argument("--output", default="benchmark_results.json", help="Where to write results")
+    run.add_argument("--quick", action="store_true", help="Skip 4k/8k images and large batches")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--filter", default=None, help="Only run cases containing this text")
+    run.add_argument("--baseline", default=None, help="Compare against this baseline after running")
+    run.add_argument("--threshold", type=float, default=0.10)
+
+    compare = subparsers.add_parser("compare", help="Compare two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.10)
+
+    case = subparsers.add_parser("case", help=argparse.SUPPRESS)
+    case.add_argument("name")
+    case.add_argument("--repeat", type=int, default=3)
+    case.add_argument("--result", required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "case":
+        save_json(run_case(args.name, args.repeat), args.result)
+        return 0
+    if args.command == "run":
+        current = run_benchmarks(quick=args.quick, repeat=args.repeat, pattern=args.filter)
+        save_json(current, args.output)
+        print(f"Results written to {args.output}")
+        if not args.baseline:
+            return 0
+        baseline = load_json(args.baseline)
+    else:
+        baseline = load_json(args.baseline)
+        current = load_json(args.current)
+
+    regressions, missing = compare_results(baseline, current, args.threshold)
+    print_comparison(regressions, missing, args.threshold)
+    return 1 if regressions or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
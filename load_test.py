@@ -0,0 +1,460 @@
+"""Concurrent-session load test harness for the PixelMed Streamlit app.
+
+Starts ``main.py`` in a headless Streamlit server backed by the offline
+replay transport (see transport.py), then drives N simulated browser
+sessions over Streamlit's websocket protocol. Each session uploads an image,
+clicks "Analyze Image" and downloads the generated Markdown and PDF reports.
+Concurrency is ramped through the requested levels, and each level reports
+throughput, p50/p95/p99 latency, error rates and server memory.
+
+Usage:
+    python load_test.py --levels 1,5,10,25 --iterations 3 --latency 1.5
+    python load_test.py --url http://localhost:8501 --server-pid 1234
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from io import BytesIO
+
+from PIL import Image
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.websocket import WebSocketError, websocket_connect
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ClientState_pb2 import ClientState
+from streamlit.proto.Common_pb2 import FileURLsRequest, FileUploaderState
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState, WidgetStates
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+ANALYZE_LABEL = "Analyze Image"
+MODEL_ERROR_PREFIX = "⚠️ Error analyzing image"
+
+FAKE_REPORT = """### 1. Image Type & Region
+- Modality: chest X-ray, posteroanterior projection
+
+### 2. Key Findings
+- No acute cardiopulmonary abnormality
+
+### 3. Diagnostic Assessment
+- Primary diagnosis: normal study (confidence 90%)
+"""
+
+
+class SessionError(Exception):
+    """Raised when a simulated session cannot complete its flow."""
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+# ------------------------------------
+# SIMULATED BROWSER SESSION
+# ------------------------------------
+class AppSession:
+    """A single headless browser session speaking Streamlit's websocket protocol."""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.http = AsyncHTTPClient()
+        self.session_id = None
+        self.ws = None
+        self._cache = {}
+
+    async def connect(self):
+        ws_url = self.base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.ws = await websocket_connect(ws_url, connect_timeout=self.timeout)
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    async def _send(self, back_msg):
+        await self.ws.write_message(back_msg.SerializeToString(), binary=True)
+
+    async def _receive(self):
+        data = await asyncio.wait_for(self.ws.read_message(), self.timeout)
+        if data is None:
+            raise SessionError("disconnect", "Server closed the websocket")
+
+        msg = ForwardMsg.FromString(data)
+        if msg.WhichOneof("type") == "ref_hash":
+            msg = await self._cached_message(msg.ref_hash)
+        elif msg.metadata.cacheable:
+            self._cache[msg.hash] = msg
+
+        if msg.WhichOneof("type") == "new_session":
+            self.session_id = msg.new_session.initialize.session_id
+        return msg
+
+    async def _cached_message(self, msg_hash):
+        if msg_hash not in self._cache:
+            response = await self.http.fetch(f"{self.base_url}/_stcore/message?hash={msg_hash}")
+            self._cache[msg_hash] = ForwardMsg.FromString(response.body)
+        return self._cache[msg_hash]
+
+    async def rerun(self, widgets=()):
+        """Rerun the script with ``widgets`` and return the elements it rendered."""
+        client_state = ClientState(widget_states=WidgetStates(widgets=list(widgets)))
+        await self._send(BackMsg(rerun_script=client_state))
+
+        elements = []
+        while True:
+            msg = await self._receive()
+            kind = msg.WhichOneof("type")
+            if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                elements.append(msg.delta.new_element)
+            elif kind == "script_finished":
+                if msg.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    elements = []
+                    continue
+                break
+
+        exception = find_element(elements, "exception")
+        if exception is not None:
+            raise SessionError("app_exception", f"{exception.type}: {exception.message}")
+        return elements
+
+    async def upload(self, uploader_id, file_name, mime_type, data):
+        """Upload a file and return the widget state for the file uploader."""
+        request_id = uuid.uuid4().hex
+        await self._send(BackMsg(file_urls_request=FileURLsRequest(
+            request_id=request_id, file_names=[file_name], session_id=self.session_id
+        )))
+
+        while True:
+            msg = await self._receive()
+            if (msg.WhichOneof("type") == "file_urls_response"
+                    and msg.file_urls_response.response_id == request_id):
+                break
+        if msg.file_urls_response.error_msg:
+            raise SessionError("upload", msg.file_urls_response.error_msg)
+        file_urls = msg.file_urls_response.file_urls[0]
+
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+            f"Content-Type: {mime_type}\r\n\r\n"
+        ).encode("utf-8") + data + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        try:
+            await self.http.fetch(
+                self.base_url + file_urls.upload_url,
+                method="PUT",
+                body=body,
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                request_timeout=self.timeout
+            )
+        except HTTPClientError as e:
+            raise SessionError("upload", f"Upload failed with HTTP {e.code}") from e
+
+        state = FileUploaderState()
+        info = state.uploaded_file_info.add()
+        info.file_id = file_urls.file_id
+        info.name = file_name
+        info.size = len(data)
+        info.file_urls.CopyFrom(file_urls)
+        return WidgetState(id=uploader_id, file_uploader_state_value=state)
+
+    async def download(self, url):
+        try:
+            response = await self.http.fetch(self.base_url + url, request_timeout=self.timeout)
+        except HTTPClientError as e:
+            raise SessionError("download", f"Download failed with HTTP {e.code}") from e
+        return len(response.body)
+
+
+def find_element(elements, kind, label=None):
+    for element in elements:
+        if element.WhichOneof("type") == kind:
+            if label is None or label in getattr(element, kind).label:
+                return getattr(element, kind)
+    return None
+
+
+async def run_flow(base_url, image_name, image_bytes, timeout):
+    """Run one upload -> analyze -> download flow and return its timings."""
+    session = AppSession(base_url, timeout)
+    start = time.perf_counter()
+    try:
+        await session.connect()
+        elements = await session.rerun()
+
+        uploader = find_element(elements, "file_uploader")
+        if uploader is None:
+            raise SessionError("render", "File uploader not rendered")
+        upload_state = await session.upload(uploader.id, image_name, "image/jpeg", image_bytes)
+
+        elements = await session.rerun([upload_state])
+        button = find_element(elements, "button", ANALYZE_LABEL)
+        if button is None:
+            raise SessionError("render", "Analyze button not rendered")
+
+        analyze_start = time.perf_counter()
+        elements = await session.rerun([upload_state, WidgetState(id=button.id, trigger_value=True)])
+        analyze_time = time.perf_counter() - analyze_start
+
+        for element in elements:
+            if (element.WhichOneof("type") == "markdown"
+                    and element.markdown.body.startswith(MODEL_ERROR_PREFIX)):
+                raise SessionError("model_error", element.markdown.body)
+
+        downloads = [e.download_button for e in elements if e.WhichOneof("type") == "download_button"]
+        if len(downloads) < 2:
+            raise SessionError("render", "Download buttons not rendered")
+        download_bytes = 0
+        for button in downloads:
+            download_bytes += await session.download(button.url)
+
+        return {
+            "ok": True,
+            "flow_time": time.perf_counter() - start,
+            "analyze_time": analyze_time,
+            "download_bytes": download_bytes,
+        }
+    except SessionError as e:
+        return {"ok": False, "error": e.kind, "detail": str(e), "flow_time": time.perf_counter() - start}
+    # An overloaded server drops sockets and fails handshakes; count these as
+    # errors so one failed flow doesn't abort the whole ramp.
+    except WebSocketError as e:
+        return {"ok": False, "error": "disconnect", "detail": repr(e), "flow_time": time.perf_counter() - start}
+    except HTTPClientError as e:
+        return {"ok": False, "error": "http", "detail": f"HTTP {e.code}: {e.message}",
+                "flow_time": time.perf_counter() - start}
+    except (asyncio.TimeoutError, OSError) as e:
+        return {"ok": False, "error": "timeout" if isinstance(e, asyncio.TimeoutError) else "connection",
+                "detail": repr(e), "flow_time": time.perf_counter() - start}
+    finally:
+        session.close()
+
+
+# ------------------------------------
+# SERVER MANAGEMENT
+# ------------------------------------
+def read_rss_mb(pid):
+    """Return the resident memory of ``pid`` in MB, or None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler:
+    """Polls the server's RSS while a concurrency level runs."""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            rss = read_rss_mb(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.pid is not None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        rss = read_rss_mb(self.pid) if self.pid is not None else None
+        if rss is not None:
+            self.samples.append(rss)
+
+
+def start_server(port, args, work_dir):
+    """Start ``main.py`` headlessly against the replay transport."""
+    env = dict(os.environ)
+    env.update({
+        "PIXELMED_TRANSPORT": "replay",
+        "PIXELMED_CASSETTE_DIR": os.path.abspath(args.cassettes),
+        "PIXELMED_REPLAY_LATENCY": str(args.latency),
+        "PIXELMED_REPLAY_JITTER": str(args.jitter),
+        "PIXELMED_REPLAY_ERROR_RATE": str(args.error_rate),
+        "PIXELMED_REPLAY_DEFAULT_TEXT": FAKE_REPORT,
+    })
+    command = [
+        sys.executable, "-m", "streamlit", "run", APP_PATH,
+        "--server.headless", "true",
+        "--server.port", str(port),
+        "--server.enableXsrfProtection", "false",
+        "--server.fileWatcherType", "none",
+        "--browser.gatherUsageStats", "false",
+    ]
+    # Run from a scratch directory so temp_image.* files land outside the repo.
+    return subprocess.Popen(command, cwd=work_dir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for_server(base_url, timeout=60):
+    http = AsyncHTTPClient()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await http.fetch(f"{base_url}/_stcore/health", request_timeout=2)
+            return
+        except (HTTPClientError, OSError):
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Streamlit server at {base_url} did not become healthy")
+
+
+# ------------------------------------
+# LOAD RAMP
+# ------------------------------------
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(level, results, elapsed, memory):
+    flow_times = [r["flow_time"] for r in results if r["ok"]]
+    analyze_times = [r["analyze_time"] for r in results if r["ok"]]
+    errors = Counter(r["error"] for r in results if not r["ok"])
+
+    return {
+        "concurrency": level,
+        "flows": len(results),
+        "succeeded": len(flow_times),
+        "error_rate": round(sum(errors.values()) / len(results), 4) if results else 0,
+        "errors": dict(errors),
+        "throughput_per_s": round(len(flow_times) / elapsed, 3) if elapsed else 0,
+        "flow_latency_s": {f"p{p}": _round(percentile(flow_times, p)) for p in (50, 95, 99)},
+        "analyze_latency_s": {f"p{p}": _round(percentile(analyze_times, p)) for p in (50, 95, 99)},
+        "server_rss_mb": {
+            "peak": _round(max(memory.samples, default=None)),
+            "end": _round(memory.samples[-1] if memory.samples else None),
+        },
+        "elapsed_s": round(elapsed, 3),
+        "error_samples": sorted({r["detail"] for r in results if not r["ok"]})[:5],
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+async def run_level(base_url, level, iterations, image_bytes, timeout, server_pid):
+    """Run ``level`` concurrent virtual users, each doing ``iterations`` flows."""
+
+    async def virtual_user(user):
+        results = []
+        for i in range(iterations):
+            results.append(await run_flow(base_url, f"scan_{user}_{i}.jpg", image_bytes, timeout))
+        return results
+
+    memory = MemorySampler(server_pid)
+    memory.start()
+    start = time.perf_counter()
+    per_user = await asyncio.gather(*(virtual_user(u) for u in range(level)))
+    elapsed = time.perf_counter() - start
+    await memory.stop()
+
+    results = [r for user_results in per_user for r in user_results]
+    return summarize(level, results, elapsed, memory)
+
+
+def make_test_image(size=1024):
+    image = Image.linear_gradient("L").resize((size, size))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def print_summary(summary):
+    flow = summary["flow_latency_s"]
+    print(
+        f"concurrency={summary['concurrency']:<4} "
+        f"flows={summary['flows']:<5} "
+        f"throughput={summary['throughput_per_s']:.2f}/s "
+        f"p50={flow['p50']} p95={flow['p95']} p99={flow['p99']} "
+        f"errors={summary['error_rate']:.1%} {summary['errors'] or ''} "
+        f"server_rss_peak={summary['server_rss_mb']['peak']} MB"
+    )
+    for sample in summary["error_samples"]:
+        print(f"    error: {sample}")
+
+
+async def run_load_test(args):
+    image_bytes = make_test_image() if args.image is None else open(args.image, "rb").read()
+    levels = [int(level) for level in args.levels.split(",")]
+    AsyncHTTPClient.configure(None, max_clients=max(levels) * 2)
+
+    server = None
+    work_dir = tempfile.mkdtemp(prefix="pixelmed-load-")
+    if args.url:
+        base_url = args.url.rstrip("/")
+        server_pid = args.server_pid
+    else:
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args.port, args, work_dir)
+        server_pid = server.pid
+
+    try:
+        await wait_for_server(base_url)
+        summaries = []
+        for level in levels:
+            summary = await run_level(base_url, level, args.iterations, image_bytes,
+                                      args.timeout, server_pid)
+            print_summary(summary)
+            summaries.append(summary)
+        return summaries
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PixelMed concurrent-session load test")
+    parser.add_argument("--levels", default="1,5,10,25", help="Comma-separated concurrency ramp")
+    parser.add_argument("--iterations", type=int, default=3, help="Flows per virtual user per level")
+    parser.add_argument("--latency", type=float, default=1.0, help="Fake model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Extra random model latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Injected model error rate")
+    parser.add_argument("--cassettes", default="cassettes", help="Cassettes served by the fake model")
+    parser.add_argument("--image", default=None, help="Image to upload (default: synthetic JPEG)")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--url", default=None, help="Use an already running app instead of starting one")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID to sample memory from with --url")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", default=None, help="Write the summaries as JSON")
+    args = parser.parse_args()
+
+    summaries = asyncio.run(run_load_test(args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Adaptive model routing for PixelMed.
+
+Each request is scored with cheap local image statistics (resolution,
+entropy and modality hints) and sent to a fast or a strong model tier.
+Low-priority requests always use the fast tier and high-priority ones the
+strong tier. When the strong tier's queue is deep, only the most complex
+images still go to it. Every tier has its own concurrency limit and keeps
+latency, error and cost metrics.
+
+Tiers wrap any transport from transport.py, so the router can be exercised
+offline with replay or fake-server backends. The policy is a dict; set
+``PIXELMED_ROUTING_POLICY`` to a JSON file to override the defaults.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from io import BytesIO
+
+from PIL import Image, ImageStat
+
+
+DEFAULT_POLICY = {
+    "tiers": {
+        "fast": {"model": "gemini-2.0-flash-lite", "max_concurrency": 8, "cost_per_call": 0.0004},
+        "strong": {"model": "gemini-2.0-flash", "max_concurrency": 4, "cost_per_call": 0.001},
+    },
+    "fast_tier": "fast",
+    "strong_tier": "strong",
+    # Images scoring at or above this go to the strong tier...
+    "complexity_threshold": 0.55,
+    # ...unless the strong tier already has this many requests queued or
+    # running, in which case only images above the busy threshold do.
+    "busy_queue_depth": 6,
+    "busy_complexity_threshold": 0.8,
+    "weights": {"resolution": 0.35, "entropy": 0.4, "modality": 0.25},
+    # Megapixels at which the resolution score saturates.
+    "full_resolution_mp": 4.0,
+    # Matched against filename tokens; the strongest match wins.
+    "modality_hints": {
+        "ct": 1.0, "mri": 1.0, "pet": 1.0, "mammo": 0.9, "mammogram": 0.9,
+        "pathology": 0.8, "histology": 0.8, "ultrasound": 0.6, "us": 0.6,
+        "xray": 0.5, "x-ray": 0.5, "cxr": 0.5, "dental": 0.4,
+        "derm": 0.3, "skin": 0.3,
+    },
+    # Used when no filename token matches, keyed by the image's colour mode.
+    "colour_mode_hints": {"color": 0.4, "grayscale": 0.5},
+    # Used when neither a filename token nor the colour mode has a hint.
+    "default_modality_score": 0.5,
+    # Mean HSV saturation (0-255) above which an image counts as colour.
+    "color_saturation_threshold": 20,
+    # Non-JPEG images larger than this are scored without decoding pixels,
+    # using this grayscale entropy (0-8 bits) in place of a measured one.
+    "max_decode_megapixels": 16,
+    "undecoded_entropy": 6.0,
+}
+
+
+def load_policy(environ=None):
+    """Return the routing policy, merged with ``PIXELMED_ROUTING_POLICY`` if set."""
+    environ = os.environ if environ is None else environ
+    policy = json.loads(json.dumps(DEFAULT_POLICY))
+
+    path = environ.get("PIXELMED_ROUTING_POLICY")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+        for key, value in overrides.items():
+            if isinstance(value, dict) and isinstance(policy.get(key), dict) and key != "tiers":
+                policy[key].update(value)
+            else:
+                policy[key] = value
+    return policy
+
+
+# ------------------------------------
+# IMAGE SCORING
+# ------------------------------------
+def modality_score(filename, is_color, policy):
+    """Return the modality hint score for an image.
+
+    Filename hints take precedence; the colour-mode hint only applies when
+    no filename token matches.
+    """
+    hints = policy["modality_hints"]
+    tokens = set()
+    if filename:
+        name = os.path.splitext(os.path.basename(filename))[0].lower()
+        tokens.update(name.replace("-", "_").replace(" ", "_").split("_"))
+        tokens.add(name)
+
+    matched = [hints[t] for t in tokens if t in hints]
+    if matched:
+        return max(matched)
+    colour_mode = "color" if is_color else "grayscale"
+    return policy["colour_mode_hints"].get(colour_mode, policy["default_modality_score"])
+
+
+def score_image(image_bytes, policy, filename=None):
+    """Return cheap image statistics and a 0-1 complexity score."""
+    image = Image.open(BytesIO(image_bytes))
+    width, height = image.size
+
+    megapixels = width * height / 1_000_000
+
+    if image.format != "JPEG" and megapixels > policy["max_decode_megapixels"]:
+        # Formats without draft() must be fully decoded before they can be
+        # shrunk, which takes seconds at 8k. Score these from the header
+        # alone: assume a typical entropy and take colour from the mode.
+        entropy = policy["undecoded_entropy"]
+        is_color = image.mode not in ("1", "L", "LA", "I", "I;16", "F")
+    else:
+        # Shrink before converting so no full-resolution copy is made; JPEG
+        # can also skip most of the decode via draft().
+        image.draft("RGB", (256, 256))
+        image.thumbnail((256, 256))
+        preview = image.convert("RGB")
+
+        saturation = ImageStat.Stat(preview.convert("HSV")).mean[1]
+        is_color = saturation >= policy["color_saturation_threshold"]
+        entropy = preview.convert("L").entropy()
+
+    modality = modality_score(filename, is_color, policy)
+
+    weights = policy["weights"]
+    resolution_score = min(1.0, megapixels / policy["full_resolution_mp"])
+    entropy_score = min(1.0, entropy / 8.0)
+    complexity = (
+        weights["resolution"] * resolution_score
+        + weights["entropy"] * entropy_score
+        + weights["modality"] * modality
+    ) / sum(weights.values())
+
+    return {
+        "width": width,
+        "height": height,
+        "megapixels": round(megapixels, 3),
+        "entropy": round(entropy, 3),
+        "color": is_color,
+        "modality_score": modality,
+        "complexity": round(complexity, 4),
+    }
+
+
+# ------------------------------------
+# MODEL TIERS
+# ------------------------------------
+class ModelTier:
+    """A model backend with a concurrency limit and running metrics."""
+
+    def __init__(self, name, transport, max_concurrency=4, cost_per_call=0.0, model_name=None):
+        self.name = name
+        self.transport = transport
+        self.model_name = model_name or name
+        self.max_concurrency = max_concurrency
+        self.cost_per_call = cost_per_call
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._waits = deque(maxlen=1000)
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.cost = 0.0
+
+    @property
+    def queue_depth(self):
+        return self.waiting + self.in_flight
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg"):
+        queued = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self._waits.append(time.perf_counter() - queued)
+
+        start = time.perf_counter()
+        try:
+            text = self.transport.generate(image_bytes, prompt, mime_type)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.calls += 1
+                self.cost += self.cost_per_call
+                self._latencies.append(elapsed)
+            self._slots.release()
+
+        return text
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            waits = sorted(self._waits)
+            return {
+                "model": self.model_name,
+                "max_concurrency": self.max_concurrency,
+                "calls": self.calls,
+                "errors": self.errors,
+                "waiting": self.waiting,
+                "in_flight": self.in_flight,
+                "cost": round(self.cost, 6),
+                "latency_p50_s": _percentile(latencies, 50),
+                "latency_p95_s": _percentile(latencies, 95),
+                "queue_wait_p95_s": _percentile(waits, 95),
+            }
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return round(ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)], 4)
+
+
+# ------------------------------------
+# ROUTER
+# ------------------------------------
+class ModelRouter:
+    """Routes each request to a tier based on image complexity and load."""
+
+    def __init__(self, tiers, policy):
+        self.tiers = tiers
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._routes = {name: 0 for name in tiers}
+
+    def choose_tier(self, profile, priority="normal"):
+        """Return the tier name for an image profile from ``score_image``."""
+        fast = self.policy["fast_tier"]
+        strong = self.policy["strong_tier"]
+
+        if priority == "low":
+            return fast
+        if priority == "high":
+            return strong
+
+        complexity = profile["complexity"]
+        if complexity < self.policy["complexity_threshold"]:
+            return fast
+        if (self.tiers[strong].queue_depth >= self.policy["busy_queue_depth"]
+                and complexity < self.policy["busy_complexity_threshold"]):
+            return fast
+        return strong
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg", filename=None, priority="normal"):
+        """Score the image, pick a tier and return ``(response_text, model_name)``."""
+        try:
+            profile = score_image(image_bytes, self.policy, filename)
+        except (OSError, ValueError):
+            # Unreadable images can't be scored; let the strong tier handle them.
+            profile = {"complexity": 1.0}
+
+        tier_name = self.choose_tier(profile, priority)
+        with self._lock:
+            self._routes[tier_name] += 1
+        tier = self.tiers[tier_name]
+        return tier.generate(image_bytes, prompt, mime_type), tier.model_name
+
+    def metrics(self):
+        with self._lock:
+            routes = dict(self._routes)
+        tiers = {name: tier.metrics() for name, tier in self.tiers.items()}
+        return {
+            "routes": routes,
+            "total_cost": round(sum(t["cost"] for t in tiers.values()), 6),
+            "tiers": tiers,
+        }
+
+
+def build_router(policy, make_transport):
+    """Create a router whose tiers use ``make_transport(model_name)`` as backends."""
+    tiers = {}
+    for name, config in policy["tiers"].items():
+        tiers[name] = ModelTier(
+            name,
+            make_transport(config["model"]),
+            max_concurrency=config.get("max_concurrency", 4),
+            cost_per_call=config.get("cost_per_call", 0.0),
+            model_name=config["model"]
+        )
+    return ModelRouter(tiers, policy)
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import load_test
+
+
+@pytest.fixture
+def http_server():
+    """Start a plain HTTP server that answers every GET with ``status``."""
+    servers = []
+
+    def start(status):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"no")
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        servers.append(server)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("status, kind", [(200, "disconnect"), (503, "http")])
+def test_run_flow_counts_handshake_failures(http_server, status, kind):
+    result = asyncio.run(load_test.run_flow(http_server(status), "scan.jpg", b"image", 5))
+    assert result["ok"] is False
+    assert result["error"] == kind
+
+
+def test_run_level_survives_failed_flows(http_server):
+    summary = asyncio.run(load_test.run_level(http_server(503), 3, 2, b"image", 5, None))
+    assert summary["flows"] == 6
+    assert summary["errors"] == {"http": 6}
+    assert summary["error_rate"] == 1.0
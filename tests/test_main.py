@@ -0,0 +1,130 @@
+import importlib.util
+import os
+
+import pytest
+from PIL import Image
+
+import main
+
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+@pytest.fixture
+def replay_router(monkeypatch):
+    monkeypatch.setenv("PIXELMED_TRANSPORT", "replay")
+    monkeypatch.setenv("PIXELMED_REPLAY_DEFAULT_TEXT", "## Findings\nNo acute findings.")
+    main.get_router.clear()
+    yield
+    main.get_router.clear()
+
+
+def rerun_main():
+    """Execute main.py as a fresh module, the way Streamlit does on rerun."""
+    spec = importlib.util.spec_from_file_location("__main__", MAIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ------------------------------------
+# ROUTER
+# ------------------------------------
+def test_get_router_is_shared_across_calls(replay_router):
+    assert main.get_router() is main.get_router()
+
+
+def test_get_router_is_shared_across_reruns(replay_router):
+    first_run = rerun_main()
+    try:
+        router = first_run.get_router()
+        assert rerun_main().get_router() is router
+    finally:
+        first_run.get_router.clear()
+
+
+def test_analyze_medical_image_uses_shared_router(replay_router, tmp_path):
+    image_path = tmp_path / "ct_head.png"
+    Image.new("RGB", (64, 64), (20, 20, 20)).save(image_path)
+
+    for _ in range(2):
+        report, model_name = main.analyze_medical_image(str(image_path), "ct_head.png")
+        assert report.startswith("## Findings")
+        assert model_name
+
+    metrics = main.get_router().metrics()
+    assert sum(metrics["routes"].values()) == 2
+    assert sum(tier["calls"] for tier in metrics["tiers"].values()) == 2
+
+
+def test_seeded_replay_errors_vary_across_reruns(replay_router, monkeypatch, tmp_path):
+    monkeypatch.setenv("PIXELMED_REPLAY_SEED", "7")
+    monkeypatch.setenv("PIXELMED_REPLAY_ERROR_RATE", "0.5")
+    image_path = tmp_path / "upload.png"
+    Image.new("RGB", (64, 64), (20, 20, 20)).save(image_path)
+
+    first_run = rerun_main()
+    try:
+        failed = []
+        for _ in range(20):
+            # Each rerun must reuse the seeded transport instead of restarting
+            # its random sequence.
+            _, model_name = rerun_main().analyze_medical_image(str(image_path))
+            failed.append(model_name is None)
+        assert any(failed) and not all(failed)
+    finally:
+        first_run.get_router.clear()
+
+
+# ------------------------------------
+# PDF REPORTS
+# ------------------------------------
+BOLD_REPORT = """### 1. **Image Type** & Region
+- **Modality:** CT, nodule <5 mm
+1. **Primary diagnosis:** normal study
+The **left** lung is clear and the **right** lung is clear.
+An unclosed **marker stays literal.
+"""
+
+
+def fonts(paragraph):
+    return [(frag.text, frag.fontName) for frag in paragraph.frags]
+
+
+def test_parse_report_markdown_converts_bold():
+    elements = main.parse_report_markdown(BOLD_REPORT, main.get_pdf_styles())
+    paragraphs = [e for e in elements if isinstance(e, main.Paragraph)]
+
+    assert ("Image Type", "Helvetica-Bold") in fonts(paragraphs[0])
+    assert ("Modality:", "Helvetica-Bold") in fonts(paragraphs[1])
+    assert "".join(text for text, _ in fonts(paragraphs[1])) == "• Modality: CT, nodule <5 mm"
+    assert ("Primary diagnosis:", "Helvetica-Bold") in fonts(paragraphs[2])
+    assert fonts(paragraphs[3]) == [
+        ("The ", "Helvetica"), ("left", "Helvetica-Bold"),
+        (" lung is clear and the ", "Helvetica"), ("right", "Helvetica-Bold"),
+        (" lung is clear.", "Helvetica"),
+    ]
+    assert fonts(paragraphs[4]) == [("An unclosed **marker stays literal.", "Helvetica")]
+
+
+def test_pdf_reports_build_with_bold(tmp_path):
+    image_path = tmp_path / "scan.png"
+    Image.new("RGB", (64, 64), (20, 20, 20)).save(image_path)
+
+    pdf_buffer = main.create_pdf_report(BOLD_REPORT, str(image_path), "scan.png", "fast-model")
+    assert pdf_buffer.getvalue().startswith(b"%PDF")
+
+    output_path = tmp_path / "combined.pdf"
+    assert main.create_combined_pdf_report([(BOLD_REPORT, str(image_path))] * 2, str(output_path)) == 2
+
+
+def test_combined_pdf_falls_back_for_unparseable_reports(tmp_path, monkeypatch):
+    image_path = tmp_path / "scan.png"
+    Image.new("RGB", (64, 64), (20, 20, 20)).save(image_path)
+
+    def reject(report_text, pdf_styles):
+        raise ValueError("bad markup")
+
+    monkeypatch.setattr(main, "parse_report_markdown", reject)
+    output_path = tmp_path / "combined.pdf"
+    assert main.create_combined_pdf_report([(BOLD_REPORT, str(image_path))], str(output_path)) == 1
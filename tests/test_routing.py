@@ -0,0 +1,187 @@
+import threading
+import time
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from routing import DEFAULT_POLICY, ModelRouter, ModelTier, load_policy, modality_score, score_image
+from transport import TransportError
+
+
+class StubTransport:
+    """Returns a fixed reply, optionally blocking until released."""
+
+    def __init__(self, text="ok", release=None, fail=False):
+        self.text = text
+        self.release = release
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg"):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if self.release is not None:
+                self.release.wait(5)
+            else:
+                time.sleep(0.01)
+            if self.fail:
+                raise TransportError("stub failure")
+            return self.text
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def make_router(policy=None):
+    policy = policy or load_policy({})
+    tiers = {
+        "fast": ModelTier("fast", StubTransport("fast reply"), 8, 0.0004, "fast-model"),
+        "strong": ModelTier("strong", StubTransport("strong reply"), 4, 0.001, "strong-model"),
+    }
+    return ModelRouter(tiers, policy)
+
+
+def png_bytes(size=(64, 64), color=(40, 40, 40), mode="RGB"):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# ------------------------------------
+# TIER SELECTION
+# ------------------------------------
+@pytest.mark.parametrize("complexity, expected", [
+    (0.0, "fast"),
+    (0.5499, "fast"),
+    (0.55, "strong"),
+    (0.9, "strong"),
+])
+def test_choose_tier_threshold(complexity, expected):
+    router = make_router()
+    assert router.choose_tier({"complexity": complexity}) == expected
+
+
+def test_choose_tier_priority_overrides_complexity():
+    router = make_router()
+    assert router.choose_tier({"complexity": 1.0}, priority="low") == "fast"
+    assert router.choose_tier({"complexity": 0.0}, priority="high") == "strong"
+
+
+@pytest.mark.parametrize("complexity, expected", [
+    (0.6, "fast"),
+    (0.7999, "fast"),
+    (0.8, "strong"),
+])
+def test_choose_tier_downgrades_when_strong_tier_busy(complexity, expected):
+    router = make_router()
+    router.tiers["strong"].waiting = DEFAULT_POLICY["busy_queue_depth"]
+    assert router.choose_tier({"complexity": complexity}) == expected
+
+
+def test_choose_tier_busy_ignores_high_priority():
+    router = make_router()
+    router.tiers["strong"].in_flight = DEFAULT_POLICY["busy_queue_depth"] + 10
+    assert router.choose_tier({"complexity": 0.6}, priority="high") == "strong"
+
+
+def test_router_generate_returns_model_name_and_counts_routes():
+    router = make_router()
+    text, model_name = router.generate(png_bytes(), "prompt", "image/png", priority="low")
+    assert (text, model_name) == ("fast reply", "fast-model")
+
+    text, model_name = router.generate(b"not an image", "prompt")
+    assert (text, model_name) == ("strong reply", "strong-model")
+
+    assert router.metrics()["routes"] == {"fast": 1, "strong": 1}
+
+
+# ------------------------------------
+# MODEL TIERS
+# ------------------------------------
+def test_tier_never_exceeds_max_concurrency():
+    release = threading.Event()
+    transport = StubTransport(release=release)
+    tier = ModelTier("fast", transport, max_concurrency=3)
+
+    threads = [threading.Thread(target=tier.generate, args=(b"", "p")) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+
+    deadline = time.time() + 5
+    while tier.metrics()["waiting"] < 7 and time.time() < deadline:
+        time.sleep(0.01)
+    metrics = tier.metrics()
+    assert metrics["in_flight"] == 3
+    assert metrics["waiting"] == 7
+    assert tier.queue_depth == 10
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert transport.max_active == 3
+    assert tier.queue_depth == 0
+
+
+def test_tier_metrics_count_calls_errors_and_cost():
+    tier = ModelTier("strong", StubTransport(), max_concurrency=2, cost_per_call=0.25, model_name="m")
+    for _ in range(3):
+        assert tier.generate(b"", "p") == "ok"
+
+    tier.transport = StubTransport(fail=True)
+    with pytest.raises(TransportError):
+        tier.generate(b"", "p")
+
+    metrics = tier.metrics()
+    assert metrics["model"] == "m"
+    assert metrics["calls"] == 4
+    assert metrics["errors"] == 1
+    assert metrics["cost"] == 1.0
+    assert metrics["in_flight"] == 0
+    assert metrics["latency_p50_s"] is not None
+
+
+def test_router_metrics_total_cost():
+    router = make_router()
+    router.generate(png_bytes(), "p", priority="low")
+    router.generate(png_bytes(), "p", priority="high")
+    assert router.metrics()["total_cost"] == pytest.approx(0.0014)
+
+
+# ------------------------------------
+# MODALITY HINTS
+# ------------------------------------
+@pytest.mark.parametrize("filename, is_color, expected", [
+    ("skin_lesion.jpg", True, 0.3),
+    ("skin_lesion.jpg", False, 0.3),
+    ("dental.png", True, 0.4),
+    ("ct_head.png", True, 1.0),
+    ("Chest-CXR 01.png", False, 0.5),
+    ("upload.png", True, 0.4),
+    ("upload.png", False, 0.5),
+    (None, True, 0.4),
+])
+def test_modality_score(filename, is_color, expected):
+    assert modality_score(filename, is_color, DEFAULT_POLICY) == expected
+
+
+def test_modality_score_falls_back_to_default():
+    policy = load_policy({})
+    policy["colour_mode_hints"] = {}
+    assert modality_score("upload.png", True, policy) == policy["default_modality_score"]
+
+
+def test_score_image_uses_filename_over_colour():
+    colour_image = png_bytes(color=(200, 30, 30))
+    assert score_image(colour_image, DEFAULT_POLICY)["color"] is True
+    assert score_image(colour_image, DEFAULT_POLICY)["modality_score"] == 0.4
+    assert score_image(colour_image, DEFAULT_POLICY, "mri_brain.png")["modality_score"] == 1.0
+
+    gray_image = png_bytes(color=128, mode="L")
+    assert score_image(gray_image, DEFAULT_POLICY)["color"] is False
+    assert score_image(gray_image, DEFAULT_POLICY, "skin.png")["modality_score"] == 0.3
@@ -0,0 +1,256 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from transport import (
+    FakeServerTransport,
+    RecordTransport,
+    ReplayTransport,
+    TransportError,
+    cassette_key,
+    make_fake_server,
+    transport_from_env,
+)
+
+
+class StubTransport:
+    def __init__(self, text="recorded", error=None):
+        self.text = text
+        self.error = error
+        self.calls = 0
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg"):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+@pytest.fixture
+def fake_server():
+    servers = []
+
+    def start(backend):
+        server = make_fake_server(backend, port=0)
+        servers.append(server)
+        return serve(server)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def raw_server():
+    """Start an HTTP server with a custom ``do_POST`` handler."""
+    servers = []
+
+    def start(do_post):
+        handler = type("Handler", (BaseHTTPRequestHandler,), {
+            "do_POST": do_post,
+            "log_message": lambda self, *args: None,
+        })
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        servers.append(server)
+        return serve(server)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+# ------------------------------------
+# CASSETTE KEYS
+# ------------------------------------
+def test_cassette_key_depends_on_image_prompt_and_model():
+    key = cassette_key(b"image", "prompt")
+    assert key == cassette_key(b"image", "prompt")
+    assert key != cassette_key(b"other", "prompt")
+    assert key != cassette_key(b"image", "other")
+
+    model_key = cassette_key(b"image", "prompt", "gemini-2.0-flash")
+    assert model_key == f"gemini-2.0-flash--{key}"
+    assert cassette_key(b"image", "prompt", "models/gemini-2.0-flash") == model_key
+    assert cassette_key(b"image", "prompt", "gemini-2.0-flash-lite") != model_key
+
+
+# ------------------------------------
+# RECORD / REPLAY
+# ------------------------------------
+def test_record_then_replay_round_trip(tmp_path):
+    recorder = RecordTransport(StubTransport("findings"), str(tmp_path))
+    assert recorder.generate(b"image", "prompt", "image/png") == "findings"
+
+    path = tmp_path / f"{cassette_key(b'image', 'prompt')}.json"
+    cassette = json.loads(path.read_text(encoding="utf-8"))
+    assert cassette["response_text"] == "findings"
+    assert cassette["mime_type"] == "image/png"
+    assert [p for p in os.listdir(tmp_path) if p.endswith(".tmp")] == []
+
+    assert ReplayTransport(str(tmp_path)).generate(b"image", "prompt") == "findings"
+
+
+def test_record_does_not_save_failed_calls(tmp_path):
+    recorder = RecordTransport(StubTransport(error=TransportError("down")), str(tmp_path))
+    with pytest.raises(TransportError):
+        recorder.generate(b"image", "prompt")
+    assert os.listdir(tmp_path) == []
+
+
+def test_replay_keeps_tiers_apart_and_falls_back_to_unkeyed_cassettes(tmp_path):
+    RecordTransport(StubTransport("fast"), str(tmp_path), "fast-model").generate(b"image", "prompt")
+    RecordTransport(StubTransport("strong"), str(tmp_path), "strong-model").generate(b"image", "prompt")
+    RecordTransport(StubTransport("legacy"), str(tmp_path)).generate(b"other", "prompt")
+
+    assert ReplayTransport(str(tmp_path), model_name="fast-model").generate(b"image", "prompt") == "fast"
+    assert ReplayTransport(str(tmp_path), model_name="strong-model").generate(b"image", "prompt") == "strong"
+    assert ReplayTransport(str(tmp_path), model_name="fast-model").generate(b"other", "prompt") == "legacy"
+    with pytest.raises(TransportError):
+        ReplayTransport(str(tmp_path)).generate(b"image", "prompt")
+
+
+def test_replay_missing_cassette(tmp_path):
+    with pytest.raises(TransportError, match="No cassette"):
+        ReplayTransport(str(tmp_path)).generate(b"image", "prompt")
+    replay = ReplayTransport(str(tmp_path), default_text="default")
+    assert replay.generate(b"image", "prompt") == "default"
+
+
+@pytest.mark.parametrize("error_rate, expected_failures", [(0.0, 0), (1.0, 20)])
+def test_replay_error_rate_bounds(tmp_path, error_rate, expected_failures):
+    replay = ReplayTransport(str(tmp_path), error_rate=error_rate, default_text="ok", seed="7")
+    failures = 0
+    for _ in range(20):
+        try:
+            replay.generate(b"image", "prompt")
+        except TransportError:
+            failures += 1
+    assert failures == expected_failures
+
+
+def test_replay_seed_is_reproducible_but_not_constant(tmp_path):
+    def outcomes():
+        replay = ReplayTransport(str(tmp_path), error_rate=0.5, default_text="ok", seed="7")
+        results = []
+        for _ in range(30):
+            try:
+                replay.generate(b"image", "prompt")
+                results.append(True)
+            except TransportError:
+                results.append(False)
+        return results
+
+    first = outcomes()
+    assert first == outcomes()
+    assert any(first) and not all(first)
+
+
+def test_replay_latency(tmp_path):
+    replay = ReplayTransport(str(tmp_path), latency=0.05, default_text="ok")
+    start = time.perf_counter()
+    replay.generate(b"image", "prompt")
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_transport_from_env_modes(tmp_path):
+    environ = {
+        "PIXELMED_TRANSPORT": "replay",
+        "PIXELMED_CASSETTE_DIR": str(tmp_path),
+        "PIXELMED_REPLAY_ERROR_RATE": "0.25",
+        "PIXELMED_REPLAY_DEFAULT_TEXT": "default",
+    }
+    replay = transport_from_env(None, environ, model_name="fast-model")
+    assert isinstance(replay, ReplayTransport)
+    assert (replay.cassette_dir, replay.error_rate, replay.model_name) == (str(tmp_path), 0.25, "fast-model")
+
+    fake = transport_from_env(None, {"PIXELMED_TRANSPORT": "fake-server"}, model_name="fast-model")
+    assert isinstance(fake, FakeServerTransport)
+    assert fake.model_name == "fast-model"
+
+    with pytest.raises(ValueError):
+        transport_from_env(None, {"PIXELMED_TRANSPORT": "bogus"})
+
+
+# ------------------------------------
+# FAKE MODEL SERVER
+# ------------------------------------
+def test_fake_server_round_trip(tmp_path, fake_server):
+    RecordTransport(StubTransport("fast"), str(tmp_path), "fast-model").generate(b"image", "prompt")
+    RecordTransport(StubTransport("legacy"), str(tmp_path)).generate(b"image", "prompt")
+    url = fake_server(ReplayTransport(str(tmp_path)))
+
+    assert FakeServerTransport(url, model_name="fast-model").generate(b"image", "prompt") == "fast"
+    assert FakeServerTransport(url, model_name="strong-model").generate(b"image", "prompt") == "legacy"
+    assert FakeServerTransport(url).generate(b"image", "prompt") == "legacy"
+
+
+def test_fake_server_reports_backend_failures(fake_server):
+    url = fake_server(StubTransport(error=TransportError("injected")))
+    with pytest.raises(TransportError, match="HTTP 503"):
+        FakeServerTransport(url).generate(b"image", "prompt")
+
+    url = fake_server(StubTransport(error=RuntimeError("bug")))
+    with pytest.raises(TransportError, match="HTTP 500"):
+        FakeServerTransport(url).generate(b"image", "prompt")
+
+
+def test_fake_server_unreachable():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    port = server.server_port
+    server.server_close()
+    with pytest.raises(TransportError, match="unreachable"):
+        FakeServerTransport(f"http://127.0.0.1:{port}", timeout=2).generate(b"image", "prompt")
+
+
+def test_fake_server_timeout(raw_server):
+    release = threading.Event()
+
+    def do_post(self):
+        release.wait(5)
+
+    url = raw_server(do_post)
+    try:
+        with pytest.raises(TransportError):
+            FakeServerTransport(url, timeout=0.2).generate(b"image", "prompt")
+    finally:
+        release.set()
+
+
+def test_fake_server_truncated_body(raw_server):
+    def do_post(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "100")
+        self.end_headers()
+        self.wfile.write(b'{"text": "cut')
+        self.close_connection = True
+
+    url = raw_server(do_post)
+    with pytest.raises(TransportError, match="request failed"):
+        FakeServerTransport(url).generate(b"image", "prompt")
+
+
+@pytest.mark.parametrize("body", [b"not json", b'{"other": 1}', b'{"text": 5}'])
+def test_fake_server_invalid_response(raw_server, body):
+    def do_post(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    url = raw_server(do_post)
+    with pytest.raises(TransportError, match="invalid response"):
+        FakeServerTransport(url).generate(b"image", "prompt")
@@ -0,0 +1,349 @@
+"""Pluggable model transports for PixelMed.
+
+The analysis pipeline talks to the model through a transport object with a
+single ``generate(image_bytes, prompt, mime_type)`` method. Besides the live
+Gemini transport, three offline modes are available:
+
+- record: call the live model and save each request/response pair as a
+  cassette keyed by model name, image hash and prompt hash
+- replay: serve responses from cassettes with synthetic latency and
+  error injection
+- fake-server: POST requests to a local HTTP stand-in (see ``serve``)
+
+Select a mode with the ``PIXELMED_TRANSPORT`` environment variable, or run
+``python transport.py serve`` to start the fake model server.
+"""
+
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_CASSETTE_DIR = "cassettes"
+DEFAULT_FAKE_SERVER_URL = "http://127.0.0.1:8765"
+
+
+class TransportError(Exception):
+    """Raised when a transport cannot produce a model response."""
+
+
+def cassette_key(image_bytes, prompt, model_name=None):
+    """Return the cassette key for an image and prompt pair.
+
+    Keys include ``model_name`` when given, so tiers recording into the same
+    cassette directory don't overwrite each other.
+    """
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    key = f"{image_hash[:32]}-{prompt_hash[:16]}"
+    if model_name:
+        model = model_name.rsplit("/", 1)[-1].replace(os.sep, "_")
+        key = f"{model}--{key}"
+    return key
+
+
+# ------------------------------------
+# LIVE TRANSPORT
+# ------------------------------------
+class LiveTransport:
+    """Sends requests to a ``genai.GenerativeModel``."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg"):
+        response = self.model.generate_content(
+            [
+                {"mime_type": mime_type, "data": image_bytes},
+                prompt
+            ]
+        )
+        return response.text
+
+
+# ------------------------------------
+# RECORD / REPLAY TRANSPORTS
+# ------------------------------------
+class RecordTransport:
+    """Forwards to another transport and saves every response as a cassette."""
+
+    def __init__(self, inner, cassette_dir=DEFAULT_CASSETTE_DIR, model_name=None):
+        self.inner = inner
+        self.cassette_dir = cassette_dir
+        self.model_name = model_name
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg"):
+        start = time.perf_counter()
+        text = self.inner.generate(image_bytes, prompt, mime_type)
+        elapsed = time.perf_counter() - start
+
+        key = cassette_key(image_bytes, prompt, self.model_name)
+        cassette = {
+            "key": key,
+            "model": self.model_name,
+            "image_sha256": hashlib.sha256(image_bytes).hexdigest(),
+            "mime_type": mime_type,
+            "prompt": prompt,
+            "response_text": text,
+            "recorded_latency": round(elapsed, 4),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+        # Write to a temporary file first so concurrent sessions never
+        # leave a half-written cassette behind.
+        path = os.path.join(self.cassette_dir, f"{key}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cassette, f, indent=2)
+        os.replace(tmp_path, path)
+
+        return text
+
+
+class ReplayTransport:
+    """Serves recorded cassettes with synthetic latency and error injection.
+
+    ``latency`` is a fixed delay in seconds and ``jitter`` adds a uniform
+    random delay on top of it. ``error_rate`` is the probability that a
+    request fails with ``TransportError``. When ``default_text`` is set it
+    is returned for requests without a cassette instead of failing.
+
+    Cassettes recorded for ``model_name`` are preferred; cassettes recorded
+    without a model name are used as a fallback.
+    """
+
+    def __init__(self, cassette_dir=DEFAULT_CASSETTE_DIR, latency=0.0, jitter=0.0,
+                 error_rate=0.0, default_text=None, seed=None, model_name=None):
+        self.cassette_dir = cassette_dir
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.default_text = default_text
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def _load(self, key):
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+
+        path = os.path.join(self.cassette_dir, f"{key}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            text = json.load(f)["response_text"]
+
+        with self._lock:
+            self._cache[key] = text
+        return text
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg", model_name=None):
+        model_name = model_name or self.model_name
+        with self._lock:
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            fail = self._rng.random() < self.error_rate
+
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise TransportError("Injected replay error")
+
+        key = cassette_key(image_bytes, prompt)
+        text = None
+        if model_name:
+            text = self._load(cassette_key(image_bytes, prompt, model_name))
+        if text is None:
+            text = self._load(key)
+        if text is None:
+            if self.default_text is None:
+                raise TransportError(f"No cassette recorded for {key}")
+            return self.default_text
+        return text
+
+
+# ------------------------------------
+# FAKE MODEL SERVER
+# ------------------------------------
+class FakeServerTransport:
+    """Sends requests to a local fake model server over HTTP."""
+
+    def __init__(self, url=DEFAULT_FAKE_SERVER_URL, timeout=60, model_name=None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.model_name = model_name
+
+    def generate(self, image_bytes, prompt, mime_type="image/jpeg"):
+        payload = json.dumps({
+            "image": base64.b64encode(image_bytes).decode("ascii"),
+            "mime_type": mime_type,
+            "prompt": prompt,
+            "model": self.model_name,
+        }).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.url}/generate",
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = response.read()
+        except urllib.error.HTTPError as e:
+            raise TransportError(f"Fake server returned HTTP {e.code}") from e
+        except urllib.error.URLError as e:
+            raise TransportError(f"Fake server unreachable: {e.reason}") from e
+        except (OSError, http.client.HTTPException) as e:
+            # Read timeouts, dropped connections and truncated responses.
+            raise TransportError(f"Fake server request failed: {e!r}") from e
+
+        try:
+            text = json.loads(data.decode("utf-8"))["text"]
+        except (ValueError, KeyError, TypeError) as e:
+            raise TransportError("Fake server sent an invalid response") from e
+        if not isinstance(text, str):
+            raise TransportError("Fake server sent an invalid response")
+        return text
+
+
+def make_fake_server(backend, host="127.0.0.1", port=8765):
+    """Return an HTTP server answering ``POST /generate`` from ``backend``.
+
+    The request's ``model`` field is passed on to ``backend`` as
+    ``model_name`` when present, so a replay backend picks that model's
+    cassettes.
+    """
+
+    class FakeModelHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/generate":
+                self._reply(404, {"error": "not found"})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length).decode("utf-8"))
+                image_bytes = base64.b64decode(request["image"])
+                prompt = request["prompt"]
+                mime_type = request.get("mime_type", "image/jpeg")
+                model_name = request.get("model")
+            except (KeyError, ValueError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+
+            try:
+                if model_name:
+                    text = backend.generate(image_bytes, prompt, mime_type, model_name=model_name)
+                else:
+                    text = backend.generate(image_bytes, prompt, mime_type)
+            except TransportError as e:
+                self._reply(503, {"error": str(e)})
+                return
+            except Exception as e:
+                self._reply(500, {"error": repr(e)})
+                return
+
+            self._reply(200, {"text": text})
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), FakeModelHandler)
+    server.daemon_threads = True
+    return server
+
+
+# ------------------------------------
+# CONFIGURATION
+# ------------------------------------
+def transport_from_env(model, environ=None, model_name=None):
+    """Build the transport selected by the ``PIXELMED_*`` environment variables.
+
+    ``PIXELMED_TRANSPORT`` is one of ``live`` (default), ``record``,
+    ``replay`` or ``fake-server``. ``model_name`` keys cassettes per model;
+    it defaults to ``model.model_name``.
+    """
+    environ = os.environ if environ is None else environ
+    mode = environ.get("PIXELMED_TRANSPORT", "live").strip().lower()
+    cassette_dir = environ.get("PIXELMED_CASSETTE_DIR", DEFAULT_CASSETTE_DIR)
+    model_name = model_name or getattr(model, "model_name", None)
+
+    if mode == "live":
+        return LiveTransport(model)
+    if mode == "record":
+        return RecordTransport(LiveTransport(model), cassette_dir, model_name)
+    if mode == "replay":
+        return ReplayTransport(
+            cassette_dir,
+            latency=float(environ.get("PIXELMED_REPLAY_LATENCY", 0)),
+            jitter=float(environ.get("PIXELMED_REPLAY_JITTER", 0)),
+            error_rate=float(environ.get("PIXELMED_REPLAY_ERROR_RATE", 0)),
+            default_text=environ.get("PIXELMED_REPLAY_DEFAULT_TEXT"),
+            seed=environ.get("PIXELMED_REPLAY_SEED"),
+            model_name=model_name
+        )
+    if mode == "fake-server":
+        return FakeServerTransport(
+            environ.get("PIXELMED_FAKE_SERVER_URL", DEFAULT_FAKE_SERVER_URL),
+            model_name=model_name
+        )
+
+    raise ValueError(f"Unknown PIXELMED_TRANSPORT mode: {mode!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PixelMed fake model server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Serve cassettes over HTTP")
+    serve.add_argument("--cassettes", default=DEFAULT_CASSETTE_DIR)
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--latency", type=float, default=0.0)
+    serve.add_argument("--jitter", type=float, default=0.0)
+    serve.add_argument("--error-rate", type=float, default=0.0)
+    serve.add_argument("--default-text", default=None)
+    serve.add_argument("--seed", default=None)
+
+    args = parser.parse_args()
+
+    backend = ReplayTransport(
+        args.cassettes,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        default_text=args.default_text,
+        seed=args.seed
+    )
+    server = make_fake_server(backend, args.host, args.port)
+    print(f"Fake model server listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()